@@ -1,9 +1,47 @@
+import argparse
+import os
+from datetime import date
+
 import pandas as pd
-from newyork_times_covid19_data_processing import *
+from newyork_times_covid19_data_processing import (
+    calculate_stats, calculate_stats_in_chunks, combine_data, get_cache_path,
+    preprocess_covid19_df, preprocess_population_df, read_cached_df,
+    read_covid19_csv, read_covid19_csv_in_chunks, write_cached_df,
+    write_stats)
 
 # --------------------- Get Command line arguments---------------------
 
 
+def parse_chunk_size_mb(value: str) -> int:
+    """
+    Function to parse chunk_size_mb command line argument
+
+    Explanation:
+        chunk size is passed to the pyarrow csv reader as block size in
+        bytes, which has to fit into int32, so it has to be between 1
+        and 2047 MB
+
+    Parameters:
+    ----------
+    value: string, command line argument value
+
+    Returns:
+    -------
+    value: int, parsed chunk size in MB
+    """
+    try:
+        chunk_size_mb = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{value!r} is not an integer")
+
+    if not 1 <= chunk_size_mb <= 2047:
+        raise argparse.ArgumentTypeError(
+            f"{value!r} is not between 1 and 2047")
+
+    return chunk_size_mb
+
+
 def get_command_line_args():
     """
     Function to read command line arguments
@@ -15,7 +53,14 @@ def get_command_line_args():
                             New York Times COVID-19 Data
         - population_csv_path: string, URL/Path for 2019
                                 Population Estimate Data
-        - output_file_path: string, Path of output csv file
+        - output_file_path: string, Path of output file, with extension
+                    of output_format by default
+        - output_format: string, Format of output file, csv or parquet
+        - no_cache: bool, Do not read or write parquet cache of
+                    preprocessed input data
+        - chunk_size_mb: int, Process New York Times COVID-19 Data
+                    in chunks of given size in MB (1 to 2047), None to process
+                    entire data at once
     """
     parser = argparse.ArgumentParser(
         description="""Prepare Covid19 cases summary with population
@@ -36,10 +81,37 @@ def get_command_line_args():
     parser.add_argument(
         '--output_file_path',
         type=str,
-        default="./aggregated_covid19_data_with_population.csv",
-        help="Path of output csv file")
+        default=None,
+        help="""Path of output file, defaults to
+                ./aggregated_covid19_data_with_population.<output_format>""")
+
+    parser.add_argument(
+        '--output_format',
+        type=str,
+        choices=["csv", "parquet"],
+        default="csv",
+        help="Format of output file")
+
+    parser.add_argument(
+        '--no_cache',
+        action="store_true",
+        help="""Do not read or write parquet cache of preprocessed input
+                data, which is stored next to the output file""")
+
+    parser.add_argument(
+        '--chunk_size_mb',
+        type=parse_chunk_size_mb,
+        default=None,
+        help="""Process New York Times COVID-19 Data in chunks of given
+                size in MB (1 to 2047) to bound the peak memory usage""")
 
     args = parser.parse_args()
+
+    # default output file extension follows the output format
+    if args.output_file_path is None:
+        args.output_file_path = \
+            f"./aggregated_covid19_data_with_population.{args.output_format}"
+
     return args
 
 # -----------------------------main function --------------------------
@@ -51,25 +123,67 @@ def main():
     # Step 1 Get input arguments
     args = get_command_line_args()
 
-    # Step 2 Get input data from source
-    df_covid = pd.read_csv(args.covid19_csv_path, dtype=object)
-
-    df_population = pd.read_csv(
-        args.population_csv_path, dtype=object, encoding="ISO-8859-1")
-
-    # Step 3 Clean input data
-    df_covid = preprocess_covid19_df(df_covid)
-
-    df_population = preprocess_population_df(df_population)
-
-    # Step 4
-    df_combined = combine_data(df_covid, df_population)
-
-    # Step 5
-    df_stats = calculate_stats(df_combined)
+    # cache preprocessed input data next to the output file
+    cache_dir = os.path.join(
+        os.path.dirname(os.path.abspath(args.output_file_path)),
+        ".covid19_data_cache")
+
+    df_population = None
+    if not args.no_cache:
+        # population data is static, so its URL needs no version
+        population_cache_path = get_cache_path(args.population_csv_path,
+                                               cache_dir)
+        df_population = read_cached_df(population_cache_path)
+
+    if df_population is None:
+        # Step 2 Get input data from source
+        df_population = pd.read_csv(
+            args.population_csv_path,
+            usecols=["STATE", "COUNTY", "POPESTIMATE2019"],
+            dtype={"STATE": "uint32", "COUNTY": "uint32",
+                   "POPESTIMATE2019": "UInt32"},
+            encoding="ISO-8859-1")
+
+        # Step 3 Clean input data
+        df_population = preprocess_population_df(df_population)
+
+        if not args.no_cache:
+            write_cached_df(df_population, population_cache_path)
+
+    if args.chunk_size_mb:
+        # Step 2 to 5 chunk by chunk, the chunks are only generated
+        # while writing them
+        df_covid_chunks = read_covid19_csv_in_chunks(args.covid19_csv_path,
+                                                     args.chunk_size_mb)
+        df_stats_chunks = calculate_stats_in_chunks(df_covid_chunks,
+                                                    df_population)
+    else:
+        df_covid = None
+        if not args.no_cache:
+            # covid19 data is updated daily
+            covid_cache_path = get_cache_path(args.covid19_csv_path,
+                                              cache_dir,
+                                              date.today().isoformat())
+            df_covid = read_cached_df(covid_cache_path)
+
+        if df_covid is None:
+            # Step 2 Get input data from source
+            df_covid = read_covid19_csv(args.covid19_csv_path)
+
+            # Step 3 Clean input data
+            df_covid = preprocess_covid19_df(df_covid)
+
+            if not args.no_cache:
+                write_cached_df(df_covid, covid_cache_path)
+
+        # Step 4
+        df_combined = combine_data(df_covid, df_population)
+
+        # Step 5
+        df_stats_chunks = [calculate_stats(df_combined)]
 
     # Step 6
-    df_stats.to_csv(args.output_file_path)
+    write_stats(df_stats_chunks, args.output_file_path, args.output_format)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,243 @@
-import argparse
+import glob
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlparse
+from urllib.request import url2pathname, urlopen
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+# ----------------------Read Data--------------------------------------
+
+COVID19_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types={"fips": pa.uint32(),
+                  "date": pa.timestamp("ns"),
+                  "cases": pa.int32(),
+                  "deaths": pa.int32()},
+    include_columns=["fips", "date", "cases", "deaths"])
+
+COVID19_TYPES_MAPPING = {pa.uint32(): pd.UInt32Dtype(),
+                         pa.int32(): pd.Int32Dtype()}
+
+
+@contextmanager
+def open_csv_source(csv_path: str):
+    """
+    Function to open csv source for the pyarrow csv reader
+
+    Explanation:
+        When csv_path is a URL, its content is yielded as a stream, so
+        that the download of the file overlaps with the parsing instead
+        of downloading the entire file first:
+        - http, https, ftp and file URLs are opened with urllib
+        - other URLs, e.g. s3, are opened with the pyarrow filesystem
+        matching the URL scheme
+        Otherwise csv_path is a local path and is yielded as it is.
+
+    Parameters:
+    ----------
+    csv_path: string, URL/Path of csv file
+    """
+    scheme = urlparse(csv_path).scheme
+
+    # single letter scheme is a windows drive letter, i.e. a local path
+    if len(scheme) <= 1:
+        yield csv_path
+    elif scheme in ("http", "https", "ftp", "file"):
+        with urlopen(csv_path) as response:
+            yield response
+    else:
+        filesystem, path = pafs.FileSystem.from_uri(csv_path)
+        with filesystem.open_input_stream(path) as stream:
+            yield stream
+
+
+def read_covid19_csv(covid19_csv_path: str) -> pd.DataFrame:
+    """
+    Function to read New York times covid 19 data
+
+    Explanation:
+        When covid19_csv_path is a URL, its content is streamed
+        directly to the pyarrow csv reader, so that the download of the
+        file overlaps with the parsing instead of downloading the entire
+        file first.
+        Only "fips", "date", "cases", "deaths" columns are read and they
+        are typecast while parsing.
+
+    Parameters:
+    ----------
+    covid19_csv_path: string, URL/Path for latest data from
+                        New York Times COVID-19 Data
+
+    Returns:
+    -------
+    df: pd.Datafame object with New York Times COVID-19 Data having
+        columns:
+            fips: UInt32
+            date: datetime64[ns]
+            cases: Int32
+            deaths: Int32
+    """
+    with open_csv_source(covid19_csv_path) as source:
+        table = pacsv.read_csv(source,
+                               convert_options=COVID19_CONVERT_OPTIONS)
+
+    return table.to_pandas(types_mapper=COVID19_TYPES_MAPPING.get)
+
+
+def read_covid19_csv_in_chunks(covid19_csv_path: str, chunk_size_mb: int)\
+        -> Iterator[pd.DataFrame]:
+    """
+    Function to read New York times covid 19 data chunk by chunk
+
+    Explanation:
+        Same as "read_covid19_csv" function, except that the csv file is
+        parsed incrementally with the pyarrow streaming csv reader and
+        each chunk of about chunk_size_mb MB of csv text is yielded as
+        soon as it is parsed, so that the entire data is never held in
+        memory.
+
+    Parameters:
+    ----------
+    covid19_csv_path: string, URL/Path for latest data from
+                        New York Times COVID-19 Data
+    chunk_size_mb: int, size of csv text parsed per chunk in MB
+
+    Returns:
+    -------
+    Iterator of pd.Datafame objects with New York Times COVID-19 Data
+        having same columns as returned by "read_covid19_csv" function
+    """
+    read_options = pacsv.ReadOptions(block_size=chunk_size_mb * 1024 * 1024)
+
+    with open_csv_source(covid19_csv_path) as source:
+        reader = pacsv.open_csv(source, read_options=read_options,
+                                convert_options=COVID19_CONVERT_OPTIONS)
+        for batch in reader:
+            yield batch.to_pandas(types_mapper=COVID19_TYPES_MAPPING.get)
+
+
+# ----------------------Cache Data-------------------------------------
+
+# version of the preprocessed data format stored in cache files,
+# increment it whenever the columns or dtypes returned by
+# "preprocess_covid19_df" or "preprocess_population_df" change
+CACHE_FORMAT_VERSION = 1
+
+
+def get_cache_path(source_path: str, cache_dir: str,
+                   version: str = "") -> str:
+    """
+    Function to get path of parquet cache file for preprocessed data
+
+    Explanation:
+        The cache file name is "covid19_data_cache_<source>_<content>"
+        where <source> is the hash of the source identity and <content>
+        is the hash of CACHE_FORMAT_VERSION and the source content
+        identity, so that different sources or versions of the same
+        source never share the same cache file:
+        - local file (path or file URL): absolute path, modification time
+        and size of the file, so that edited files are read again
+        - other URL: URL and version, e.g. date of download for the
+        data which is updated daily
+
+    Parameters:
+    ----------
+    source_path: string, URL/Path of the source csv file
+    cache_dir: string, Path of directory to store cache files in
+    version: string, version of the source data, only used for URL
+        sources
+
+    Returns:
+    -------
+    cache_path: string, Path of parquet cache file
+    """
+    parsed_path = urlparse(source_path)
+
+    # single letter scheme is a windows drive letter, i.e. a local path
+    local_path = None
+    if len(parsed_path.scheme) <= 1:
+        local_path = source_path
+    elif parsed_path.scheme == "file":
+        local_path = url2pathname(parsed_path.path)
+
+    if local_path is not None and os.path.exists(local_path):
+        stat = os.stat(local_path)
+        source_key = os.path.abspath(local_path)
+        content_key = f"{stat.st_mtime_ns}|{stat.st_size}"
+    else:
+        source_key = source_path
+        content_key = version
+
+    source_key = hashlib.sha256(source_key.encode()).hexdigest()
+    content_key = hashlib.sha256(
+        f"{CACHE_FORMAT_VERSION}|{content_key}".encode()).hexdigest()
+
+    return os.path.join(
+        cache_dir,
+        f"covid19_data_cache_{source_key[:16]}_{content_key[:16]}.parquet")
+
+
+def read_cached_df(cache_path: str) -> Optional[pd.DataFrame]:
+    """
+    Function to read preprocessed data from parquet cache file
+
+    Parameters:
+    ----------
+    cache_path: string, Path of parquet cache file
+
+    Returns:
+    -------
+    df: pd.DataFrame object with preprocessed data, or None if cache
+        file does not exist
+    """
+    if not os.path.exists(cache_path):
+        return None
+
+    return pd.read_parquet(cache_path)
+
+
+def write_cached_df(df: pd.DataFrame, cache_path: str) -> None:
+    """
+    Function to write preprocessed data to parquet cache file
+
+    Explanation:
+        The data is first written to a temporary file in the cache
+        directory, which is then renamed to cache_path, so that a crash
+        while writing never leaves a partially written cache file.
+        Older cache files of the same source, i.e. with the same
+        "covid19_data_cache_<source>_" prefix, are removed afterwards.
+
+    Parameters:
+    ----------
+    df: pd.DataFrame object with preprocessed data
+    cache_path: string, Path of parquet cache file
+    """
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            df.to_parquet(temp_file)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    source_prefix = os.path.basename(cache_path).rsplit("_", 1)[0]
+    for old_cache_path in glob.glob(
+            os.path.join(glob.escape(cache_dir),
+                         f"{source_prefix}_*.parquet")):
+        if old_cache_path != cache_path:
+            os.remove(old_cache_path)
 
 # ----------------------Clean Data-------------------------------------
 
@@ -11,40 +249,38 @@ def preprocess_covid19_df(df_covid: pd.DataFrame) -> pd.DataFrame:
     Explanation:
         Drop records with null values: Drop records with null values in
             "fips", "date", "cases", "deaths" columns
-        Typecast to float: cases and deaths to float
-        Typecast date to datetime64[ns]
+        Typecast fips to uint32
+        Typecasting is done while reading the csv file, i.e. cases and
+            deaths as Int32 and date as datetime64[ns]
 
     Parameters:
     ----------
     df: pd.Datafame object with New York Times COVID-19 Data having
         columns:
-            fips: string
-            date: string
-            county: string
-            state: string
-            cases: string, The total number of cases of Covid-19, 
+            fips: UInt32
+            date: datetime64[ns]
+            cases: Int32, The total number of cases of Covid-19,
                     including both confirmed and probable
-            deaths: string, The total number of deaths from Covid-19,
-                    including both confirmed and probable. 
+            deaths: Int32, The total number of deaths from Covid-19,
+                    including both confirmed and probable.
     Returns:
     -------
-    df: pd.Datafame object with preprocessed New York Times COVID-19 
+    df: pd.Datafame object with preprocessed New York Times COVID-19
         Data having columns:
-            fips: string
+            fips: uint32
             date: datetime64[ns]
-            cases: float
-            deaths: float
+            cases: Int32
+            deaths: Int32
     """
     feature_list = ["fips", "date", "cases", "deaths"]
 
-    # feature selection
-    df_covid = df_covid[feature_list]
+    # columns are already typed while reading, so feature selection,
+    # dropping records with null values and typecasting fips to plain
+    # uint32 join key are done in a single masked gather
+    mask = df_covid[feature_list].notna().all(axis=1)
+    df_covid = df_covid.loc[mask, feature_list].astype(
+        dtype={"fips": "uint32"})
 
-    df_covid = df_covid.dropna(subset=feature_list)
-
-    df_covid = df_covid.astype(dtype={"cases": float,
-                                      "deaths": float,
-                                      "date": "datetime64[ns]"})
     return df_covid
 
 
@@ -54,33 +290,31 @@ def preprocess_population_df(df_population: pd.DataFrame) \
     Function to preprocess the Population Estimate Data 2019
 
     Explanation:
-        generate fips code: combine "STATE" and "COUNTY" columns
-            to generate fips code
-        typecast POPESTIMATE2019: typecast "POPESTIMATE2019" as float
+        generate fips code: combine "STATE" and "COUNTY" codes
+            to generate fips code as uint32, i.e. STATE * 1000 + COUNTY
+        POPESTIMATE2019 is typecast to UInt32 while reading the csv file
 
     Parameters:
     ----------
     df_population: pd.DataFrame object having Population Estimate Data 2019
     with columns:
-            "STATE":string
-            "COUNTY":string
-            "POPESTIMATE2019":string
+            "STATE":uint32
+            "COUNTY":uint32
+            "POPESTIMATE2019":UInt32
 
     Returns:
     -------
     df_population: pd.DataFrame object having Population Estimate Data 2019
     with columns:
-            "POPESTIMATE2019":float
-            "fips":string
+            "POPESTIMATE2019":UInt32
+            "fips":uint32
     """
     # columns to keep
     feature_list = ["fips", "POPESTIMATE2019"]
 
-    # create fips code by concatenating STATE and COUNTY codes
-    df_population["fips"] = df_population["STATE"].str.strip() \
-        + df_population["COUNTY"].str.strip()
-
-    df_population = df_population.astype(dtype={"POPESTIMATE2019": float})
+    # create fips code from 2 digit STATE and 3 digit COUNTY codes
+    df_population["fips"] = df_population["STATE"] * 1000 \
+        + df_population["COUNTY"]
 
     return df_population[feature_list]
 
@@ -101,27 +335,31 @@ def combine_data(df_covid: pd.DataFrame, df_population: pd.DataFrame)\
     ---------
     df_covid: pd.DataFrame object with processed New York Times
         COVID-19 Data having columns:
-            "fips": string
+            "fips": uint32
             "date": datetime64[ns]
-            "cases": float
-            "deaths": float
+            "cases": Int32
+            "deaths": Int32
 
     df_population: pd.DataFrame object with Population Estimate
         Data 2019 having columns:
-            "fips": string
-            "POPESTIMATE2019": float
+            "fips": uint32
+            "POPESTIMATE2019": UInt32
     Returns:
     -------
     df_combined: pd.DataFrame object with combined data having
         columns:
-            "fips": string
+            "fips": uint32
             "date": datetime64[ns]
-            "cases": float
-            "deaths": float
-            "POPESTIMATE2019": float
+            "cases": Int32
+            "deaths": Int32
+            "POPESTIMATE2019": UInt32
     """
-    #
-    df_combined = df_covid.merge(df_population, on="fips", how="left")
+    # fips is unique in population data, so join on its index
+    df_population = df_population.set_index("fips")
+
+    df_combined = df_covid.merge(df_population, left_on="fips",
+                                 right_index=True, how="left", sort=False,
+                                 validate="m:1")
 
     feature_list = ["fips", "date", "cases", "deaths", "POPESTIMATE2019"]
 
@@ -130,9 +368,11 @@ def combine_data(df_covid: pd.DataFrame, df_population: pd.DataFrame)\
 # -----------Calculate Statistics on combined dataframe----------------
 
 
-def calculate_stats_by_county(df_county: pd.DataFrame) -> pd.DataFrame:
+def calculate_stats(df_combined: pd.DataFrame,
+                    df_previous: pd.DataFrame = None) -> pd.DataFrame:
     """
-    Function to generate statistics for filtered dataframe by fips code
+    Function to generate statistics for each fips code in combined
+    dataframe
 
     Explanation:
     -----------
@@ -147,91 +387,197 @@ def calculate_stats_by_county(df_county: pd.DataFrame) -> pd.DataFrame:
 
     Parameters:
     ----------
-    df: pd.DataFrame object with data filtered by fips code from
-        combined dataframe having following columns:
+    df: pd.DataFrame object with combined data having
+        columns:
+            "fips": uint32
             "date": datetime64[ns]
-            "cases": float
-            "deaths": float
-            "POPESTIMATE2019": float
+            "cases": Int32
+            "deaths": Int32
+            "POPESTIMATE2019": UInt32
+    df_previous: pd.DataFrame object indexed by "fips" with the last
+        "cumulative_cases_to_date" and "cumulative_deaths_to_date"
+        values of earlier records, used as starting point of daily
+        counts when the data is processed chunk by chunk. When None,
+        daily counts start from 0 for every fips code.
+
     Returns:
-    ----------
-    df: pd.DataFrame object with generated stats on the data filtered
-        by fips code from combined dataframe having following columns:
+    -------
+    df: pd.DataFrame object with generated statistics on combined
+        dataframe having following columns:
+            "fips": uint32
             "date": datetime64[ns]
-            "population":float
-            "daily_cases":float
-            "daily_deaths":float
-            "cumulative_cases_to_date":float
-            "cumulative_deaths_to_date":float
+            "population":Int64
+            "daily_cases":Int32
+            "daily_deaths":Int32
+            "cumulative_cases_to_date":Int32
+            "cumulative_deaths_to_date":Int32
     """
-    df_county = df_county.sort_values(by="date")
-    df_county.index = df_county.date
-
-    # calculate daily cases count
+    # sort once by fips and date so that every fips group is contiguous
+    # and ordered by date in increasing order
+    df_combined = df_combined.sort_values(by=["fips", "date"],
+                                          kind="mergesort",
+                                          ignore_index=True)
+    df_group = df_combined.groupby("fips", sort=False)
+
+    # calculate daily cases and deaths count
     # daily_cases[i] = cases[i]-cases[i-1] except value at 0th index
+    # of each fips group, which is same as cumulative value
     # Assumption:
     #  - Date column is contious that is there is no missing date value
-    #  in entire filtered dataframe by fips code
-    #  - The value in Date column is sorted increasing order
-    df_county["daily_cases"] = df_county['cases'] - \
-        df_county['cases'].shift(fill_value=0)
+    #  for any fips code
+    # cases and deaths have no null values, so only the 0th value of
+    # each fips group is null after diff
+    df_first = df_combined[["cases", "deaths"]]
+    if df_previous is not None:
+        df_previous = df_previous.reindex(df_combined["fips"]).fillna(0)
+        df_previous.index = df_combined.index
+        df_previous.columns = ["cases", "deaths"]
+        df_first = df_first - df_previous
+
+    df_daily = df_group[["cases", "deaths"]].diff().fillna(df_first)
+
+    # build output dataframe directly from the required columns without
+    # copying them, so that no intermediate dataframe has to be projected
+    df = pd.DataFrame(
+        {"population": (df_combined["POPESTIMATE2019"].array
+                        - df_combined["deaths"].array),
+         "daily_cases": df_daily["cases"].array,
+         "daily_deaths": df_daily["deaths"].array,
+         "cumulative_cases_to_date": df_combined["cases"].array,
+         "cumulative_deaths_to_date": df_combined["deaths"].array},
+        index=pd.MultiIndex.from_arrays(
+            [df_combined["fips"].array, df_combined["date"].array],
+            names=["fips", "date"]),
+        copy=False)
+
+    return df
+
 
-    # calculate daily deaths count
-    df_county["daily_deaths"] = df_county['deaths'] - \
-        df_county['deaths'].shift(fill_value=0)
+def calculate_stats_in_chunks(df_covid_chunks: Iterable[pd.DataFrame],
+                              df_population: pd.DataFrame)\
+        -> Iterator[pd.DataFrame]:
+    """
+    Function to generate statistics defined in "calculate_stats"
+    function chunk by chunk
+
+    Explanation:
+        Each chunk of New York Times COVID-19 Data is preprocessed,
+        combined with population data and used to generate statistics.
+        The last cumulative cases and deaths of each fips code are kept
+        between chunks, so that daily counts of the first record of a
+        fips code in a chunk are calculated from its last record in
+        earlier chunks.
+        Assumption:
+            - The records of a fips code in a chunk are later in date
+            than its records in earlier chunks, i.e. the data is sorted
+            by date as in New York Times COVID-19 Data.
+
+    Parameters:
+    ----------
+    df_covid_chunks: Iterable of pd.DataFrame objects with New York Times
+        COVID-19 Data as returned by "read_covid19_csv_in_chunks" function
+    df_population: pd.DataFrame object with preprocessed Population
+        Estimate Data 2019
+
+    Returns:
+    -------
+    Iterator of pd.DataFrame objects with generated statistics as
+        returned by "calculate_stats" function
+    """
+    feature_list = ["cumulative_cases_to_date", "cumulative_deaths_to_date"]
+
+    df_previous = None
+    for df_covid in df_covid_chunks:
+        df_covid = preprocess_covid19_df(df_covid)
 
-    # rename columns
-    df_county.rename(columns={"cases": "cumulative_cases_to_date",
-                              "deaths": "cumulative_deaths_to_date"},
-                     inplace=True)
-    # calculate updated population to date
-    df_county["population"] = (df_county["POPESTIMATE2019"]
-                               - df_county["cumulative_deaths_to_date"])
+        df_combined = combine_data(df_covid, df_population)
 
-    # keep only required columns
-    feature_list = ["population", "daily_cases",
-                    "daily_deaths", "cumulative_cases_to_date",
-                    "cumulative_deaths_to_date"]
+        df_stats = calculate_stats(df_combined, df_previous)
 
-    df_county = df_county[feature_list]
+        df_last = df_stats.groupby(level="fips")[feature_list].last()
+        df_previous = df_last if df_previous is None \
+            else df_last.combine_first(df_previous)
 
-    return df_county
+        yield df_stats
 
+# ----------------------Write Data-------------------------------------
 
-def calculate_stats(df_combined: pd.DataFrame) -> pd.DataFrame:
+
+STATS_SCHEMA = pa.schema([("fips", pa.string()),
+                          ("date", pa.date32()),
+                          ("population", pa.int64()),
+                          ("daily_cases", pa.int32()),
+                          ("daily_deaths", pa.int32()),
+                          ("cumulative_cases_to_date", pa.int32()),
+                          ("cumulative_deaths_to_date", pa.int32())])
+
+
+def stats_to_table(df_stats: pd.DataFrame) -> pa.Table:
     """
-    Function to generate statistics defined in "calculate_stats"
-    function for each fips code in combined dataframe
+    Function to convert generated statistics to pyarrow table for writing
+
+    Explanation:
+        fips is converted to 5 digit code, i.e. with leading zeros
+        date is converted to standard date format
 
     Parameters:
     ----------
-    df: pd.DataFrame object with combined data having
-        columns:
-            "fips": string
-            "date": datetime64[ns]
-            "cases": float
-            "deaths": float
-            "POPESTIMATE2019": float
+    df_stats: pd.DataFrame object with generated statistics as returned
+        by "calculate_stats" function
 
     Returns:
     -------
-    df: pd.DataFrame object with generated statistics on combined
-        dataframe having following columns:
-            "fips": string
-            "date": datetime64[ns]
-            "population":float
-            "daily_cases":float
-            "daily_deaths":float
-            "cumulative_cases_to_date":float
-            "cumulative_deaths_to_date":float
+    table: pa.Table object with "fips", "date" and statistics columns
+        having STATS_SCHEMA schema
     """
+    table = pa.Table.from_pandas(df_stats.reset_index(),
+                                 preserve_index=False)
+    table = table.set_column(
+        table.schema.get_field_index("fips"), "fips",
+        pc.utf8_lpad(table["fips"].cast(pa.string()), width=5, padding="0"))
+    table = table.set_column(table.schema.get_field_index("date"), "date",
+                             table["date"].cast(pa.date32()))
 
-    df = df_combined.groupby("fips")\
-        .apply(lambda df_fips: calculate_stats_by_county(df_fips))
+    return table.cast(STATS_SCHEMA)
 
-    feature_list = ["population", "daily_cases",
-                    "daily_deaths", "cumulative_cases_to_date",
-                    "cumulative_deaths_to_date"]
-    df = df[feature_list]
 
-    return df
+def write_stats(df_stats_chunks: Iterable[pd.DataFrame],
+                output_file_path: str, output_format: str = "csv") -> None:
+    """
+    Function to write generated statistics to the output file
+
+    Explanation:
+        Statistics are written chunk by chunk as they are generated,
+        so that only one chunk is converted and held at a time. The
+        header (schema for parquet) is written even when there are no
+        chunks.
+        fips is written as 5 digit code, i.e. with leading zeros
+        csv: written with the multithreaded pyarrow csv writer instead
+            of the pure python pandas csv writer. date is written in
+            standard date format.
+        parquet: written as zstd compressed parquet file, which is much
+            smaller and can be read back column wise.
+
+    Parameters:
+    ----------
+    df_stats_chunks: Iterable of pd.DataFrame objects with generated
+        statistics as returned by "calculate_stats" function
+    output_file_path: string, Path of output file
+    output_format: string, "csv" or "parquet"
+    """
+    if output_format == "parquet":
+        with pq.ParquetWriter(output_file_path, STATS_SCHEMA,
+                              compression="zstd") as writer:
+            for df_stats in df_stats_chunks:
+                writer.write_table(stats_to_table(df_stats))
+        return
+
+    write_options = pacsv.WriteOptions(include_header=False,
+                                       quoting_style="none")
+
+    with open(output_file_path, "wb") as output_file:
+        # pyarrow always quotes the header, so it is written separately
+        output_file.write((",".join(STATS_SCHEMA.names) + "\n").encode())
+        for df_stats in df_stats_chunks:
+            pacsv.write_csv(stats_to_table(df_stats), output_file,
+                            write_options=write_options)